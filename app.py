@@ -1,13 +1,17 @@
 """Flask application for PDF to MD translation service."""
-import json
 import logging
-from flask import Flask, jsonify, request, Response, stream_with_context
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import threading
+import time
+import zlib
+import orjson
+from flask import Flask, jsonify, request, Response
+from pathlib import Path
 from typing import Dict, Any, Generator
-from feishu_client import FeishuClient
+from feishu_client import FeishuClient, has_origin_file, target_columns_empty
 from pdf_processor import PDFProcessor
 from utils import setup_logging, ensure_directories, cleanup_files
-from config import LOG_DIR, ORIGIN_COLUMN, TARGET_FILE_COLUMN, TARGET_CONTEXT_COLUMN
+from config import LOG_DIR
 
 # Setup logging
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -21,139 +25,230 @@ app = Flask(__name__)
 feishu_client = FeishuClient()
 pdf_processor = PDFProcessor(feishu_client)
 
-# Thread pool executor for parallel processing
-executor = ThreadPoolExecutor(max_workers=5)
+# Thread pool executor for parallel processing, shared with batch processing
+executor = pdf_processor.executor
 
+# Example client page, read once since it is static
+_INDEX_HTML_PATH = Path(__file__).parent / 'example_client.html'
+_INDEX_HTML = _INDEX_HTML_PATH.read_text(encoding='utf-8') if _INDEX_HTML_PATH.exists() else None
 
-def _stream_error(message: str) -> Generator[str, None, None]:
+# Window for coalescing record completions into one progress_batch event (seconds)
+_PROGRESS_BATCH_WINDOW = 0.05
+
+# Static SSE framing, encoded once
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+
+def _sse(data: Dict[str, Any]) -> bytes:
+    """Encode a payload as a single SSE data frame.
+    
+    Args:
+        data: JSON-serializable payload
+        
+    Returns:
+        Encoded SSE frame ready to be written to the response
+    """
+    return _SSE_PREFIX + orjson.dumps(data) + _SSE_SUFFIX
+
+
+def _stream_error(message: str) -> Generator[bytes, None, None]:
     """Generator function that yields an error message in SSE format.
     
     Args:
         message: Error message to send
         
     Yields:
-        JSON string with error information
+        Encoded SSE frame with error information
     """
     error_data = {
         'type': 'error',
         'status': 'error',
         'message': message
     }
-    yield f"data: {json.dumps(error_data)}\n\n"
+    yield _sse(error_data)
 
 
-def _stream_progress() -> Generator[str, None, None]:
+def _gzip_stream(frames: Generator[bytes, None, None]) -> Generator[bytes, None, None]:
+    """Gzip-compress a stream of SSE frames.
+    
+    Each frame is followed by a sync flush so the client can decode it
+    immediately instead of waiting for the compressor to fill a block.
+    
+    Args:
+        frames: Encoded SSE frames
+        
+    Yields:
+        Gzip-compressed chunks, one per frame, plus the gzip trailer
+    """
+    compressor = zlib.compressobj(wbits=31)
+    try:
+        for frame in frames:
+            yield compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # Close the wrapped stream right away when the client disconnects
+        frames.close()
+
+
+def _stream_progress() -> Generator[bytes, None, None]:
     """Generator function that yields progress updates for pagination and record processing.
     
+    Pages are fetched on a separate thread and their eligible records are submitted for
+    processing as soon as the page is loaded, so processing overlaps with pagination.
+    Both sides report through a queue that this generator drains. When the generator is
+    closed early (the client disconnected or stopped), pagination stops and records that
+    have not started yet are cancelled.
+    
     Yields:
-        JSON strings with progress updates for both pagination and processing
+        Encoded SSE frames with progress updates for both pagination and processing
     """
+    futures = {}
+    stop = threading.Event()
+    submit_lock = threading.Lock()
+    
     try:
         processed = 0
         failed = 0
         failed_records = []
-        records = []
-        total = 0
+        completed = 0
+        submitted = 0
+        total = None
+        events = queue.Queue()
+        
+        def _paginate() -> None:
+            """Load pages and submit their eligible records, reporting to the event queue."""
+            nonlocal submitted
+            try:
+                for event_type, page_info, page_records in feishu_client.list_records_streaming(collect_records=False):
+                    if stop.is_set():
+                        return
+                    events.put((event_type, page_info))
+                    if event_type == 'page_loaded':
+                        for record in page_records:
+                            with submit_lock:
+                                if stop.is_set():
+                                    return
+                                future = executor.submit(pdf_processor.process_record, record)
+                                futures[future] = record
+                                submitted += 1
+                            future.add_done_callback(lambda f: events.put(('record_done', f)))
+            except Exception as e:
+                events.put(('error', e))
+        
+        def _batch_frame(batch: list) -> bytes:
+            """Encode progress entries as one progress_batch event.
+            
+            Fields shared by every entry (type and total) are sent once on the batch
+            instead of being repeated in each entry.
+            """
+            return _sse({
+                'type': 'progress_batch',
+                'total': total if total is not None else submitted,
+                'events': batch
+            })
         
         # Send initial status for pagination
-        yield f"data: {json.dumps({'type': 'pagination_start', 'message': 'Starting to fetch records from FEISHU table'})}\n\n"
-        
-        # Stream pagination progress
-        for event_type, page_info, page_records in feishu_client.list_records_streaming():
-            if event_type == 'page_loaded':
-                # Yield page progress update
-                page_data = {
-                    'type': 'page_loaded',
-                    'status': 'progress',
-                    'page_number': page_info['page_number'],
-                    'records_in_page': page_info['records_in_page'],
-                    'eligible_in_page': page_info['eligible_in_page'],
-                    'total_eligible_so_far': page_info['total_eligible_so_far'],
-                    'has_more_pages': page_info['has_more_pages'],
-                    'message': f"Loaded page {page_info['page_number']}: {page_info['records_in_page']} records, {page_info['eligible_in_page']} eligible"
-                }
-                yield f"data: {json.dumps(page_data)}\n\n"
-            elif event_type == 'records_ready':
-                # All records collected
-                records = page_records
-                total = len(records)
-                ready_data = {
-                    'type': 'records_ready',
-                    'status': 'success',
-                    'total': total,
-                    'total_pages': page_info['total_pages'],
-                    'message': f'Finished loading {total} eligible records from {page_info["total_pages"]} pages'
-                }
-                yield f"data: {json.dumps(ready_data)}\n\n"
+        yield _sse({'type': 'pagination_start', 'message': 'Starting to fetch records from FEISHU table'})
         
-        if not records:
-            yield f"data: {json.dumps({'type': 'error', 'status': 'error', 'message': 'No eligible records found'})}\n\n"
-            return
-        
-        # Send initial status for processing
-        yield f"data: {json.dumps({'type': 'processing_start', 'total': total, 'message': f'Starting processing of {total} records'})}\n\n"
-        
-        # Process records in parallel
-        futures = {}
-        for record in records:
-            future = executor.submit(pdf_processor.process_record, record)
-            record_name = feishu_client.get_record_name(record)
-            futures[future] = {'record_id': record.record_id, 'name': record_name}
-        
-        # Collect results and stream updates
-        for future in as_completed(futures):
-            record_info = futures[future]
-            record_id = record_info['record_id']
-            record_name = record_info['name']
+        threading.Thread(target=_paginate, name='feishu-pagination', daemon=True).start()
+        
+        while total is None or completed < total:
+            items = [events.get()]
             
-            try:
-                success = future.result()
-                if success:
-                    processed += 1
-                    progress_data = {
-                        'type': 'progress',
+            # Coalesce records that finish close together into one progress_batch event
+            if items[0][0] == 'record_done':
+                deadline = time.monotonic() + _PROGRESS_BATCH_WINDOW
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(events.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            
+            batch = []
+            for event_type, payload in items:
+                if event_type == 'record_done':
+                    completed += 1
+                    # Only records still running are kept, so finished ones can be freed
+                    record = futures.pop(payload)
+                    record_id, record_name = record.record_id, record.name
+                    
+                    try:
+                        success = payload.result()
+                        if success:
+                            processed += 1
+                            status = 'success'
+                            message = f'Record {record_name} ({record_id}) processed successfully'
+                            logger.info(f"Record {record_id} processed successfully")
+                        else:
+                            failed += 1
+                            failed_records.append(record_id)
+                            status = 'failed'
+                            message = f'Record {record_name} ({record_id}) processing failed'
+                            logger.warning(f"Record {record_id} processing failed")
+                    except Exception as e:
+                        failed += 1
+                        failed_records.append(record_id)
+                        status = 'error'
+                        message = f'Record {record_name} ({record_id}) processing error: {str(e)}'
+                        logger.error(f"Record {record_id} processing error: {e}")
+                    
+                    batch.append({
                         'record_id': record_id,
                         'record_name': record_name,
-                        'status': 'success',
+                        'status': status,
                         'processed': processed,
                         'failed': failed,
-                        'total': total,
-                        'message': f'Record {record_name} ({record_id}) processed successfully'
+                        'message': message
+                    })
+                    continue
+                
+                # Keep progress that arrived first ahead of the pagination event
+                if batch:
+                    yield _batch_frame(batch)
+                    batch = []
+                
+                if event_type == 'error':
+                    raise payload
+                elif event_type == 'page_loaded':
+                    # Yield page progress update
+                    page_data = {
+                        'type': 'page_loaded',
+                        'status': 'progress',
+                        'page_number': payload['page_number'],
+                        'records_in_page': payload['records_in_page'],
+                        'eligible_in_page': payload['eligible_in_page'],
+                        'total_eligible_so_far': payload['total_eligible_so_far'],
+                        'has_more_pages': payload['has_more_pages'],
+                        'message': f"Loaded page {payload['page_number']}: {payload['records_in_page']} records, {payload['eligible_in_page']} eligible"
                     }
-                    logger.info(f"Record {record_id} processed successfully")
-                else:
-                    failed += 1
-                    failed_records.append(record_id)
-                    progress_data = {
-                        'type': 'progress',
-                        'record_id': record_id,
-                        'record_name': record_name,
-                        'status': 'failed',
-                        'processed': processed,
-                        'failed': failed,
+                    yield _sse(page_data)
+                elif event_type == 'records_ready':
+                    # All records collected
+                    total = payload['total_eligible']
+                    ready_data = {
+                        'type': 'records_ready',
+                        'status': 'success',
                         'total': total,
-                        'message': f'Record {record_name} ({record_id}) processing failed'
+                        'total_pages': payload['total_pages'],
+                        'message': f'Finished loading {total} eligible records from {payload["total_pages"]} pages'
                     }
-                    logger.warning(f"Record {record_id} processing failed")
-            except Exception as e:
-                failed += 1
-                failed_records.append(record_id)
-                progress_data = {
-                    'type': 'progress',
-                    'record_id': record_id,
-                    'record_name': record_name,
-                    'status': 'error',
-                    'processed': processed,
-                    'failed': failed,
-                    'total': total,
-                    'message': f'Record {record_name} ({record_id}) processing error: {str(e)}'
-                }
-                logger.error(f"Record {record_id} processing error: {e}")
+                    yield _sse(ready_data)
+                    
+                    if not total:
+                        yield _sse({'type': 'error', 'status': 'error', 'message': 'No eligible records found'})
+                        return
+                    
+                    yield _sse({'type': 'processing_start', 'total': total, 'message': f'Processing {total} records'})
             
-            # Stream progress update
-            yield f"data: {json.dumps(progress_data)}\n\n"
+            # Stream all progress updates of this window as one event
+            if batch:
+                yield _batch_frame(batch)
         
-        # Cleanup temporary files
+        # Cleanup temporary files left behind by any record
         cleanup_files()
         
         # Send final status
@@ -166,7 +261,7 @@ def _stream_progress() -> Generator[str, None, None]:
             'failed': failed,
             'failed_records': failed_records
         }
-        yield f"data: {json.dumps(final_data)}\n\n"
+        yield _sse(final_data)
     except Exception as e:
         logger.error(f"Error in _stream_progress: {e}", exc_info=True)
         error_data = {
@@ -174,7 +269,15 @@ def _stream_progress() -> Generator[str, None, None]:
             'status': 'error',
             'message': str(e)
         }
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield _sse(error_data)
+    finally:
+        # Stop pagination and drop queued records if the stream ended early; records already
+        # running still finish, and process_record removes their files
+        with submit_lock:
+            stop.set()
+            pending = list(futures)
+        for future in pending:
+            future.cancel()
 
 
 @app.route('/translate/all', methods=['GET'])
@@ -200,13 +303,22 @@ def translate_all():
         
         # If streaming mode requested, return SSE stream (which handles pagination internally)
         if stream_mode:
+            headers = {
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'Vary': 'Accept-Encoding'
+            }
+            stream = _stream_progress()
+            # Compare the quality, since `in` also matches an explicit gzip;q=0 refusal
+            if request.accept_encodings['gzip'] > 0:
+                stream = _gzip_stream(stream)
+                headers['Content-Encoding'] = 'gzip'
+            # The generators need no request context, so it is not kept alive
+            # for the lifetime of the stream
             return Response(
-                stream_with_context(_stream_progress()),
+                stream,
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no'
-                }
+                headers=headers
             )
         
         # Otherwise, use original non-streaming approach
@@ -225,33 +337,23 @@ def translate_all():
         total = len(records)
         logger.info(f"Found {total} eligible records to process")
         
-        futures = {}
-        for record in records:
-            future = executor.submit(pdf_processor.process_record, record)
-            futures[future] = record.record_id
+        results = pdf_processor.process_records(records)
         
         # Collect results
         processed = 0
         failed = 0
         failed_records = []
         
-        for future in as_completed(futures):
-            record_id = futures[future]
-            try:
-                success = future.result()
-                if success:
-                    processed += 1
-                    logger.info(f"Record {record_id} processed successfully")
-                else:
-                    failed += 1
-                    failed_records.append(record_id)
-                    logger.warning(f"Record {record_id} processing failed")
-            except Exception as e:
+        for record_id, success in results.items():
+            if success:
+                processed += 1
+                logger.info(f"Record {record_id} processed successfully")
+            else:
                 failed += 1
                 failed_records.append(record_id)
-                logger.error(f"Record {record_id} processing error: {e}")
+                logger.warning(f"Record {record_id} processing failed")
         
-        # Cleanup temporary files
+        # Cleanup temporary files left behind by any record
         cleanup_files()
         
         response = {
@@ -271,7 +373,7 @@ def translate_all():
         if stream_mode:
             # Return SSE stream for error case
             return Response(
-                stream_with_context(_stream_error(str(e))),
+                _stream_error(str(e)),
                 mimetype='text/event-stream',
                 headers={
                     'Cache-Control': 'no-cache',
@@ -320,28 +422,21 @@ def translate_record():
         
         # Check if record is eligible
         fields = record.fields
-        origin_field = fields.get(ORIGIN_COLUMN, {})
-        target_file_field = fields.get(TARGET_FILE_COLUMN, {})
-        target_context_field = fields.get(TARGET_CONTEXT_COLUMN, {})
         
-        origin_has_value = origin_field and isinstance(origin_field, list) and len(origin_field) > 0
-        target_file_empty = not target_file_field or not isinstance(target_file_field, list) or len(target_file_field) == 0
-        target_context_empty = not target_context_field or (isinstance(target_context_field, str) and not target_context_field.strip())
-        
-        if not origin_has_value:
+        if not has_origin_file(fields):
             return jsonify({
                 'status': 'error',
                 'message': f'Record {record_id} has no PDF file in origin column'
             }), 400
         
-        if not (target_file_empty and target_context_empty):
+        if not target_columns_empty(fields):
             return jsonify({
                 'status': 'error',
                 'message': f'Record {record_id} already has target columns filled'
             }), 400
         
         # Process the record
-        success = pdf_processor.process_record(record)
+        success = pdf_processor.process_record(feishu_client.to_eligible_record(record))
         
         # Cleanup temporary files
         cleanup_files()
@@ -389,18 +484,11 @@ def index():
     Returns:
         HTML page for testing the translation service
     """
-    try:
-        from pathlib import Path
-        html_path = Path(__file__).parent / 'example_client.html'
-        if html_path.exists():
-            return html_path.read_text(encoding='utf-8'), 200, {'Content-Type': 'text/html'}
-        else:
-            return jsonify({
-                'message': 'Example client HTML not found. Use /translate/all?stream=true for streaming API.'
-            }), 404
-    except Exception as e:
-        logger.error(f"Error serving index page: {e}")
-        return jsonify({'error': str(e)}), 500
+    if _INDEX_HTML is None:
+        return jsonify({
+            'message': 'Example client HTML not found. Use /translate/all?stream=true for streaming API.'
+        }), 404
+    return _INDEX_HTML, 200, {'Content-Type': 'text/html; charset=utf-8'}
 
 
 if __name__ == '__main__':
@@ -408,5 +496,6 @@ if __name__ == '__main__':
     ensure_directories()
     
     logger.info("Starting PDF to MD Translation Service")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Each SSE client holds one thread for the duration of its stream
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
 
@@ -17,7 +17,21 @@ ORIGIN_COLUMN = os.environ['ORIGIN_COLUMN']
 TARGET_FILE_COLUMN = os.environ['TARGET_FILE_COLUMN']
 TARGET_CONTEXT_COLUMN = os.environ['TARGET_CONTEXT_COLUMN']
 NAME_COLUMN = os.environ['NAME_COLUMN']
-SINGLE_PAGE_SIZE = os.environ['SINGLE_PAGE_SIZE'] if os.environ['SINGLE_PAGE_SIZE'] else 500
+
+# Records per list request, capped at 500 which is the maximum the list API accepts
+SINGLE_PAGE_SIZE = min(int(os.environ.get('SINGLE_PAGE_SIZE') or 500), 500)
+
+# Worker threads for record processing. Work is mostly network I/O, so the
+# default oversubscribes the CPU count, capped to stay friendly to the APIs.
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS') or min(32, (os.cpu_count() or 1) * 4))
+
+# PDFs sent to Doc2X in one conversion call during batch processing. Smaller batches
+# let uploads start sooner; larger ones mean fewer calls.
+CONVERT_BATCH_SIZE = max(int(os.environ.get('CONVERT_BATCH_SIZE') or 8), 1)
+
+# Seconds converted ZIPs are kept on disk so re-runs skip Doc2X. 0 removes all
+# temporary files at the end of every run.
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS') or 24 * 60 * 60)
 
 # File paths using pathlib.Path
 BASE_DIR = Path(__file__).parent
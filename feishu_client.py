@@ -1,7 +1,12 @@
 """FEISHU BaseOpenSDK client wrapper for table operations."""
 import json
 import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import List, Optional, Generator, Tuple
+import requests
+from requests.adapters import HTTPAdapter
 from baseopensdk import BaseClient, JSON
 from baseopensdk.api.base.v1 import *
 from baseopensdk.api.drive.v1 import *
@@ -14,160 +19,295 @@ from config import (
     TARGET_FILE_COLUMN,
     TARGET_CONTEXT_COLUMN,
     NAME_COLUMN,
-    SINGLE_PAGE_SIZE
+    SINGLE_PAGE_SIZE,
+    MAX_WORKERS
 )
 
 logger = logging.getLogger(__name__)
 
+# Buffer size for copying downloaded files to disk
+_COPY_CHUNK_SIZE = 1 << 20
+
+# Maximum number of records the batch update API accepts per request
+BATCH_UPDATE_SIZE = 500
+
+# Only the columns used for filtering and processing are requested when listing records
+_LIST_FIELD_NAMES = json.dumps(
+    [NAME_COLUMN, ORIGIN_COLUMN, TARGET_FILE_COLUMN, TARGET_CONTEXT_COLUMN],
+    ensure_ascii=False
+)
+
+
+class _PooledRequests:
+    """Stand-in for the requests module that sends requests through one shared Session.
+    
+    The SDK transport calls the module-level requests.request, which opens a new
+    connection (and TLS handshake) per API call. Routing it through a Session keeps
+    connections alive and reuses them across worker threads.
+    """
+    
+    def __init__(self, pool_size: int):
+        """Create the shared session.
+        
+        Args:
+            pool_size: Maximum number of connections kept per host
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def request(self, method, url, **kwargs):
+        """Send a request through the shared session."""
+        return self.session.request(method, url, **kwargs)
+    
+    def __getattr__(self, name):
+        """Defer everything else (exceptions, helpers) to the requests module."""
+        return getattr(requests, name)
+
+
+def _install_pooled_session() -> None:
+    """Make the SDK transport reuse pooled HTTP connections, if its layout is as expected."""
+    try:
+        from baseopensdk.core.http import transport
+    except ImportError:
+        logger.warning("SDK transport not found, HTTP connections will not be pooled")
+        return
+    
+    if getattr(transport, 'requests', None) is requests:
+        # All record work shares MAX_WORKERS threads; the other half covers page listings,
+        # prefetches and batch updates issued from request threads
+        transport.requests = _PooledRequests(pool_size=MAX_WORKERS * 2)
+        logger.info("SDK HTTP requests routed through a pooled session")
+
+
+@dataclass
+class EligibleRecord:
+    """Record that needs processing, with the values the pipeline reads resolved once."""
+    __slots__ = ('record_id', 'name', 'origin_token')
+    
+    record_id: str
+    name: str
+    origin_token: Optional[str]
+
+
+def has_origin_file(fields: dict, _origin=ORIGIN_COLUMN, _list=list) -> bool:
+    """Check whether the origin column of a record holds a file.
+    
+    Args:
+        fields: Fields of a record from FEISHU
+        
+    Returns:
+        True if the origin column is a non-empty attachment list
+    """
+    origin_field = fields.get(_origin)
+    return type(origin_field) is _list and len(origin_field) > 0
+
+
+def target_columns_empty(
+    fields: dict,
+    _target_file=TARGET_FILE_COLUMN,
+    _target_context=TARGET_CONTEXT_COLUMN,
+    _list=list,
+    _str=str
+) -> bool:
+    """Check whether both target columns of a record are still empty.
+    
+    Args:
+        fields: Fields of a record from FEISHU
+        
+    Returns:
+        True if neither a target file nor a non-blank target context is set
+    """
+    target_file_field = fields.get(_target_file)
+    if type(target_file_field) is _list and target_file_field:
+        return False
+    
+    target_context_field = fields.get(_target_context)
+    return not target_context_field or (type(target_context_field) is _str and not target_context_field.strip())
+
+
+def _is_eligible(fields: dict) -> bool:
+    """Check whether a record needs processing: origin column has a file and target columns are empty.
+    
+    Column names and types are bound as default arguments of the checks, so the per-record
+    work is local lookups and exact type comparisons, without placeholder dict allocations.
+    
+    Args:
+        fields: Fields of a record from FEISHU
+        
+    Returns:
+        True if the record should be processed
+    """
+    return has_origin_file(fields) and target_columns_empty(fields)
+
+
+def _target_fields(file_token: str, context: str) -> dict:
+    """Build the target column values written back to a processed record.
+    
+    Args:
+        file_token: File token of the uploaded ZIP
+        context: Context text extracted from the ZIP
+        
+    Returns:
+        Fields dict for the record update request
+    """
+    return {
+        TARGET_CONTEXT_COLUMN: context,
+        TARGET_FILE_COLUMN: [{"file_token": file_token}]
+    }
+
 
 class FeishuClient:
     """Client for interacting with FEISHU BaseOpenSDK."""
     
     def __init__(self):
         """Initialize FEISHU client with tokens from config."""
+        _install_pooled_session()
         self.client: BaseClient = BaseClient.builder() \
             .app_token(APP_TOKEN) \
             .personal_base_token(PERSONAL_BASE_TOKEN) \
             .build()
         logger.info("FEISHU client initialized")
     
-    def list_records(self) -> List:
+    def _fetch_page(self, page_token: Optional[str] = None) -> Tuple[List, Optional[str]]:
+        """Fetch a single page of records from the table.
+        
+        Args:
+            page_token: Token of the page to fetch, None for the first page
+            
+        Returns:
+            Tuple of (records in the page, token of the next page or None if this is the last page)
+        """
+        # A fresh builder per page, since setting page_token mutates the builder
+        builder = ListAppTableRecordRequest.builder() \
+            .table_id(TABLE_ID) \
+            .page_size(SINGLE_PAGE_SIZE) \
+            .field_names(_LIST_FIELD_NAMES)
+        if page_token:
+            builder = builder.page_token(page_token)
+        
+        logger.debug(f"Fetching page with page token: {page_token}")
+        try:
+            response = self.client.base.v1.app_table_record.list(builder.build())
+            # API errors come back in the response instead of being raised; treating them as an
+            # empty last page would silently truncate the table
+            if not response.success():
+                raise RuntimeError(f"list rejected: {response.code} {response.msg}")
+        except Exception as e:
+            logger.error(f"Error listing records: {e}")
+            raise
+        records = getattr(response.data, 'items', None) or []
+        
+        # The last page may still carry a page_token, has_more is authoritative
+        next_page_token = getattr(response.data, 'page_token', None)
+        if not getattr(response.data, 'has_more', False):
+            next_page_token = None
+        return records, next_page_token
+    
+    def _iter_pages(self) -> Generator[Tuple[List, bool], None, None]:
+        """Iterate over all pages of the table, prefetching the next page.
+        
+        Pages are cursor-based, so the next request can only start once the current page
+        returned its token. It is then issued in the background while the caller filters
+        the current page. A failed prefetch is retried once in the foreground.
+        
+        Yields:
+            Tuples of (records in the page, whether more pages follow)
+        """
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='feishu-prefetch') as prefetcher:
+            records, page_token = self._fetch_page()
+            while True:
+                next_page = prefetcher.submit(self._fetch_page, page_token) if page_token else None
+                yield records, next_page is not None
+                
+                if next_page is None:
+                    break
+                try:
+                    records, next_page_token = next_page.result()
+                except Exception as e:
+                    logger.warning(f"Prefetching next page failed, retrying: {e}")
+                    records, next_page_token = self._fetch_page(page_token)
+                page_token = next_page_token
+    
+    def list_records(self) -> List[EligibleRecord]:
         """Fetch all records from table, filter where origin column is not empty and target columns are empty.
         
         Returns:
             List of eligible records that need processing
         """
         eligible_records = []
-        page_token = None
-        base_request = ListAppTableRecordRequest.builder() \
-            .table_id(TABLE_ID) \
-            .page_size(SINGLE_PAGE_SIZE)
 
-        while True:
-            if page_token:
-                request = base_request.page_token(page_token).build()
-            else:
-                request = base_request.build()
+        for records, _ in self._iter_pages():
+            logger.info(f"Found {len(records)} records")
             
-            try:
-                response = self.client.base.v1.app_table_record.list(request)
-                records = getattr(response.data, 'items', [])
-                logger.info(f"Found {len(records)} records")
-                
-                for record in records:
-                    record_id = record.record_id
-                    fields = record.fields
-                    
-                    # Get field values
-                    origin_field = fields.get(ORIGIN_COLUMN, {})
-                    target_file_field = fields.get(TARGET_FILE_COLUMN, {})
-                    target_context_field = fields.get(TARGET_CONTEXT_COLUMN, {})
-                    
-                    # Check if origin column has value (PDF file)
-                    origin_has_value = origin_field and isinstance(origin_field, list) and len(origin_field) > 0
-                    
-                    # Check if target columns are empty
-                    target_file_empty = not target_file_field or not isinstance(target_file_field, list) or len(target_file_field) == 0
-                    target_context_empty = not target_context_field or (isinstance(target_context_field, str) and not target_context_field.strip())
-                    
-                    # Record is eligible if origin has value and targets are empty
-                    if origin_has_value and target_file_empty and target_context_empty:
-                        eligible_records.append(record)
-                        logger.debug(f"Found eligible record: {record_id}")
-                
-                # Check if there are more pages
-                page_token = getattr(response.data, 'page_token', None)
-                if not page_token:
-                    break
-                    
-            except Exception as e:
-                logger.error(f"Error listing records: {e}")
-                raise
+            for record in records:
+                if _is_eligible(record.fields):
+                    eligible_records.append(self.to_eligible_record(record))
+                    logger.debug(f"Found eligible record: {record.record_id}")
         
         logger.info(f"Found {len(eligible_records)} eligible records")
         return eligible_records
     
-    def list_records_streaming(self) -> Generator[Tuple[str, dict, List], None, None]:
+    def list_records_streaming(self, collect_records: bool = True) -> Generator[Tuple[str, dict, List[EligibleRecord]], None, None]:
         """Fetch all records from table with streaming progress updates for each page.
         
+        Args:
+            collect_records: Whether to keep all eligible records for the final 'records_ready' event.
+                             Callers consuming records per page can disable it to avoid retaining them.
+        
         Yields:
             Tuples of (event_type, page_info, records) where:
             - event_type: 'page_loaded' for page progress, 'records_ready' for final records
             - page_info: Dictionary with page number, records in page, eligible count
-            - records: List of eligible records from current page (for 'page_loaded') or all records (for 'records_ready')
+            - records: List of eligible records from current page (for 'page_loaded') or all records
+              (for 'records_ready', empty if collect_records is False)
         """
         eligible_records = []
-        page_token = None
+        total_eligible = 0
         page_number = 0
 
-        while True:
+        for records, has_more_pages in self._iter_pages():
             page_number += 1
-            logger.info(f"Page {page_number} started, using page token: {page_token}")
-            if page_token:
-                # request = base_request.page_token(page_token).build()
-                request = ListAppTableRecordRequest.builder() \
-                    .table_id(TABLE_ID) \
-                    .page_size(SINGLE_PAGE_SIZE) \
-                    .page_token(page_token) \
-                    .build()
-            else:
-                request = ListAppTableRecordRequest.builder() \
-                    .table_id(TABLE_ID) \
-                    .page_size(SINGLE_PAGE_SIZE) \
-                    .build()
+            logger.info(f"Found {len(records)} records on page {page_number}")
             
-            try:
-                response = self.client.base.v1.app_table_record.list(request)
-                records = getattr(response.data, 'items', [])
-                logger.info(f"Found {len(records)} records on page {page_number}")
-                
-                page_eligible_count = 0
-                for record in records:
-                    record_id = record.record_id
-                    fields = record.fields
-                    
-                    # Get field values
-                    origin_field = fields.get(ORIGIN_COLUMN, {})
-                    target_file_field = fields.get(TARGET_FILE_COLUMN, {})
-                    target_context_field = fields.get(TARGET_CONTEXT_COLUMN, {})
-                    
-                    # Check if origin column has value (PDF file)
-                    origin_has_value = origin_field and isinstance(origin_field, list) and len(origin_field) > 0
-                    
-                    # Check if target columns are empty
-                    target_file_empty = not target_file_field or not isinstance(target_file_field, list) or len(target_file_field) == 0
-                    target_context_empty = not target_context_field or (isinstance(target_context_field, str) and not target_context_field.strip())
-                    
-                    # Record is eligible if origin has value and targets are empty
-                    if origin_has_value and target_file_empty and target_context_empty:
-                        eligible_records.append(record)
-                        page_eligible_count += 1
-                        logger.debug(f"Found eligible record: {record_id}")
-                
-                # Check if there are more pages
-                page_token = getattr(response.data, 'page_token', None)
-                logger.info(f"Page token: {page_token}")
-                break # temporary test
-
-                if not page_token:
-                    break
-                
-            except Exception as e:
-                logger.error(f"Error listing records: {e}")
-                raise
+            page_eligible = []
+            for record in records:
+                if _is_eligible(record.fields):
+                    page_eligible.append(self.to_eligible_record(record))
+                    logger.debug(f"Found eligible record: {record.record_id}")
+            
+            total_eligible += len(page_eligible)
+            if collect_records:
+                eligible_records.extend(page_eligible)
 
             page_info = {
                 'page_number': page_number,
                 'records_in_page': len(records),
-                'eligible_in_page': page_eligible_count,
-                'total_eligible_so_far': len(eligible_records),
-                'has_more_pages': page_token is not None
+                'eligible_in_page': len(page_eligible),
+                'total_eligible_so_far': total_eligible,
+                'has_more_pages': has_more_pages
             }
-            yield ('page_loaded', page_info, eligible_records[-page_eligible_count:] if page_eligible_count > 0 else [])
+            yield ('page_loaded', page_info, page_eligible)
         
-        logger.info(f"Found {len(eligible_records)} eligible records total")
+        logger.info(f"Found {total_eligible} eligible records total")
         # Yield final records ready event
-        yield ('records_ready', {'total_eligible': len(eligible_records), 'total_pages': page_number}, eligible_records)
+        yield ('records_ready', {'total_eligible': total_eligible, 'total_pages': page_number}, eligible_records)
+    
+    def to_eligible_record(self, record) -> EligibleRecord:
+        """Resolve the values needed for processing from a FEISHU record.
+        
+        Args:
+            record: Record object from FEISHU
+            
+        Returns:
+            EligibleRecord holding the record ID, name and origin file token
+        """
+        return EligibleRecord(
+            record_id=record.record_id,
+            name=self.get_record_name(record),
+            origin_token=self.get_origin_file_token(record)
+        )
     
     def get_record_by_id(self, record_id: str):
         """Get a specific record by ID.
@@ -200,7 +340,7 @@ class FeishuClient:
             Name string from the record
         """
         fields = record.fields
-        name_field = fields.get(NAME_COLUMN, {})
+        name_field = fields.get(NAME_COLUMN)
         
         # Handle different field types (text, number, etc.)
         if isinstance(name_field, (str, int, float)):
@@ -222,7 +362,7 @@ class FeishuClient:
             File token string or None if not found
         """
         fields = record.fields
-        origin_field = fields.get(ORIGIN_COLUMN, {})
+        origin_field = fields.get(ORIGIN_COLUMN)
         
         if isinstance(origin_field, list) and len(origin_field) > 0:
             file_item = origin_field[0]
@@ -303,8 +443,9 @@ class FeishuClient:
             safe_name = sanitize_filename(name)
             pdf_path = output_path / f"{safe_name}.pdf"
             
+            # Copy in chunks instead of materializing the whole PDF as one bytes object
             with open(pdf_path, 'wb') as f:
-                f.write(response.file.read())
+                shutil.copyfileobj(response.file, f, length=_COPY_CHUNK_SIZE)
             
             logger.info(f"Downloaded PDF for record {record_id}: {pdf_path}")
             return pdf_path
@@ -313,51 +454,102 @@ class FeishuClient:
             logger.error(f"Error downloading PDF for record {record_id}: {e}")
             raise
     
-    def upload_zip_and_context(self, record_id: str, zip_path: Path, context: str) -> None:
-        """Upload ZIP file and update record with file_token and context text.
+    def upload_zip(self, zip_path: Path, file_name: Optional[str] = None) -> str:
+        """Upload a ZIP file as a table attachment.
         
         Args:
-            record_id: Record ID to update
             zip_path: Path to ZIP file to upload
-            context: Context text to set in target context column
+            file_name: Name of the uploaded file, defaults to the ZIP's own file name
+            
+        Returns:
+            File token of the uploaded ZIP
         """
         try:
-            # Upload ZIP file
             with open(zip_path, 'rb') as f:
-                file_size = zip_path.stat().st_size
-                request = UploadAllMediaRequest.builder() \
-                    .request_body(UploadAllMediaRequestBody.builder() \
-                        .file_name(zip_path.name) \
-                        .parent_type("bitable_file") \
-                        .parent_node(APP_TOKEN) \
-                        .size(file_size) \
-                        .file(f.read()) \
-                        .build()) \
-                    .build()
-                
-                response: UploadAllMediaResponse = self.client.drive.v1.media.upload_all(request)
-                file_token = response.data.file_token
+                payload = f.read()
+            
+            request = UploadAllMediaRequest.builder() \
+                .request_body(UploadAllMediaRequestBody.builder() \
+                    .file_name(file_name or zip_path.name) \
+                    .parent_type("bitable_file") \
+                    .parent_node(APP_TOKEN) \
+                    .size(len(payload)) \
+                    .file(payload) \
+                    .build()) \
+                .build()
             
-            # Update record with file token and context
+            response: UploadAllMediaResponse = self.client.drive.v1.media.upload_all(request)
+            if not response.success():
+                raise RuntimeError(f"upload rejected: {response.code} {response.msg}")
+            return response.data.file_token
+            
+        except Exception as e:
+            logger.error(f"Error uploading ZIP {zip_path}: {e}")
+            raise
+    
+    def update_record(self, record_id: str, file_token: str, context: str) -> None:
+        """Update a record with the uploaded ZIP file and context text.
+        
+        Args:
+            record_id: Record ID to update
+            file_token: File token of the uploaded ZIP
+            context: Context text to set in target context column
+        """
+        try:
             request = UpdateAppTableRecordRequest.builder() \
                 .table_id(TABLE_ID) \
                 .record_id(record_id) \
                 .request_body(AppTableRecord.builder() \
-                    .fields({
-                        TARGET_CONTEXT_COLUMN: context,
-                        TARGET_FILE_COLUMN: [{"file_token": file_token}]
-                    }) \
+                    .fields(_target_fields(file_token, context)) \
                     .build()) \
                 .build()
             
             response: UpdateAppTableRecordResponse = self.client.base.v1.app_table_record.update(request)
+            if not response.success():
+                raise RuntimeError(f"update rejected: {response.code} {response.msg}")
             logger.info(f"Updated record {record_id} with ZIP file and context")
             
         except Exception as e:
-            logger.error(f"Error uploading ZIP and context for record {record_id}: {e}")
+            logger.error(f"Error updating record {record_id}: {e}")
             raise
-
-
-# Global client instance
-client = FeishuClient()
-
+    
+    def batch_update_records(self, updates: List[Tuple[str, str, str]]) -> List[str]:
+        """Update several records with their uploaded ZIP file and context text.
+        
+        Records are sent in chunks of up to 500, the most one batch update request accepts.
+        A failed or rejected chunk is logged and skipped, so the remaining chunks are still sent.
+        
+        Args:
+            updates: Tuples of (record ID, file token of the uploaded ZIP, context text)
+            
+        Returns:
+            IDs of the records that were updated
+        """
+        updated = []
+        for start in range(0, len(updates), BATCH_UPDATE_SIZE):
+            chunk = updates[start:start + BATCH_UPDATE_SIZE]
+            try:
+                request = BatchUpdateAppTableRecordRequest.builder() \
+                    .table_id(TABLE_ID) \
+                    .request_body(BatchUpdateAppTableRecordRequestBody.builder() \
+                        .records([
+                            AppTableRecord.builder() \
+                                .record_id(record_id) \
+                                .fields(_target_fields(file_token, context)) \
+                                .build()
+                            for record_id, file_token, context in chunk
+                        ]) \
+                        .build()) \
+                    .build()
+                
+                response: BatchUpdateAppTableRecordResponse = self.client.base.v1.app_table_record.batch_update(request)
+                if not response.success():
+                    logger.error(f"Batch update of {len(chunk)} records rejected: {response.code} {response.msg}")
+                    continue
+                updated.extend(record_id for record_id, _, _ in chunk)
+                logger.info(f"Updated {len(chunk)} records with ZIP file and context")
+                
+            except Exception as e:
+                logger.error(f"Error updating {len(chunk)} records: {e}")
+        
+        return updated
@@ -1,15 +1,88 @@
 """PDF processing module for downloading, converting, and extracting context."""
+import io
 import logging
+import threading
+import weakref
 import zipfile
-import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from pdfdeal import Doc2X
-from config import PDFDEAL_TOKEN, PDFS_DIR, ZIPS_DIR, EXTRACTED_DIR, ORIGIN_COLUMN
-from feishu_client import FeishuClient
+from config import PDFDEAL_TOKEN, PDFS_DIR, ZIPS_DIR, ORIGIN_COLUMN, MAX_WORKERS, CONVERT_BATCH_SIZE
+from feishu_client import FeishuClient, EligibleRecord, BATCH_UPDATE_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Characters decoded per read when extracting the Markdown context from a ZIP
+_READ_CHUNK_SIZE = 1 << 16
+
+# Field IDs by column name, shared by all processors and worker threads. The table is
+# fixed by TABLE_ID, so every column is looked up at most once per process.
+_FIELD_ID_CACHE: Dict[str, str] = {}
+_FIELD_ID_LOCK = threading.Lock()
+
+# Locks by origin file, held while its PDF is downloaded, converted or removed. Records
+# sharing an origin file wait for each other and then reuse the converted ZIP. A lock is
+# dropped as soon as no thread holds a reference to it.
+_ORIGIN_LOCKS = weakref.WeakValueDictionary()
+_ORIGIN_LOCKS_LOCK = threading.Lock()
+
+
+def _is_converted(zip_path: Path) -> bool:
+    """Check whether a readable ZIP from an earlier conversion is already on disk.
+    
+    Args:
+        zip_path: Expected path of the converted ZIP file
+        
+    Returns:
+        True if the ZIP exists and is a valid archive
+    """
+    return zip_path.exists() and zipfile.is_zipfile(zip_path)
+
+
+def _file_stem(record: EligibleRecord) -> str:
+    """Build the name of a record's temporary files.
+    
+    Files are named after the origin file token rather than the record, so a cached ZIP
+    is only ever reused for the very PDF it was converted from. Replacing a record's
+    attachment yields a new token and therefore a fresh conversion.
+    
+    Args:
+        record: Record to build the file name for
+        
+    Returns:
+        Filesystem-safe file name without extension
+    """
+    from utils import sanitize_filename
+    
+    return sanitize_filename(record.origin_token or record.record_id)
+
+
+def _origin_lock(record: EligibleRecord) -> threading.Lock:
+    """Get the lock guarding the temporary files of a record's origin file.
+    
+    Args:
+        record: Record whose origin file is about to be processed
+        
+    Returns:
+        Lock shared by all records with the same origin file
+    """
+    with _ORIGIN_LOCKS_LOCK:
+        return _ORIGIN_LOCKS.setdefault(_file_stem(record), threading.Lock())
+
+
+def _cached_zip(record: EligibleRecord) -> Optional[Path]:
+    """Look up the converted ZIP of a record's origin file from an earlier run.
+    
+    Args:
+        record: Record whose origin file should have been converted
+        
+    Returns:
+        Path to the cached ZIP file or None if the origin file was not converted yet
+    """
+    zip_path = ZIPS_DIR / f"{_file_stem(record)}.zip"
+    return zip_path if _is_converted(zip_path) else None
+
 
 class PDFProcessor:
     """Processor for PDF download, conversion, and context extraction."""
@@ -22,32 +95,45 @@ class PDFProcessor:
         """
         self.feishu_client = feishu_client
         self.pdf_deal_client = Doc2X(apikey=PDFDEAL_TOKEN, debug=True)
-        self._field_id_cache = None
+        # One executor for all record work, so concurrent runs and streams together stay
+        # within MAX_WORKERS threads and the matching HTTP connection pool
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='pdf-worker')
         logger.info("PDF processor initialized")
     
-    def _get_field_id(self) -> Optional[str]:
-        """Get field_id for ORIGIN_COLUMN, with caching.
+    def _get_field_id(self, column: str = ORIGIN_COLUMN) -> Optional[str]:
+        """Get field_id for a column, with caching.
+        
+        Safe to call from several worker threads; only the first caller per column hits the API.
         
+        Args:
+            column: Column name to look up
+            
         Returns:
             Field ID string or None if not found
         """
-        if self._field_id_cache is None:
-            self._field_id_cache = self.feishu_client.get_field_id(ORIGIN_COLUMN)
-        return self._field_id_cache
+        field_id = _FIELD_ID_CACHE.get(column)
+        if field_id is None:
+            with _FIELD_ID_LOCK:
+                field_id = _FIELD_ID_CACHE.get(column)
+                if field_id is None:
+                    field_id = self.feishu_client.get_field_id(column)
+                    if field_id is not None:
+                        _FIELD_ID_CACHE[column] = field_id
+        return field_id
     
-    def download_pdf(self, record) -> Optional[Path]:
+    def download_pdf(self, record: EligibleRecord) -> Optional[Path]:
         """Download PDF for a single record.
         
         Args:
-            record: Record object from FEISHU
+            record: Eligible record to download the origin PDF for
             
         Returns:
             Path to downloaded PDF file or None if failed
         """
         try:
             record_id = record.record_id
-            name = self.feishu_client.get_record_name(record)
-            file_token = self.feishu_client.get_origin_file_token(record)
+            name = record.name
+            file_token = record.origin_token
             
             if not file_token:
                 logger.warning(f"No file token found for record {record_id}")
@@ -65,7 +151,7 @@ class PDFProcessor:
                 record_id=record_id,
                 file_token=file_token,
                 field_id=field_id,
-                name=name,
+                name=_file_stem(record),
                 output_path=PDFS_DIR
             )
             
@@ -85,38 +171,55 @@ class PDFProcessor:
         Returns:
             Path to converted ZIP file or None if failed
         """
-        try:
-            from utils import sanitize_filename
-            
-            # Sanitize filename
-            safe_name = sanitize_filename(name)
-            zip_path = ZIPS_DIR / f"{safe_name}.zip"
-            
-            # Prepare lists for pdfdeal
-            waiting_process_list = [pdf_path]
-            renamed_path_list = [zip_path]
-            
-            # Convert PDF to ZIP
-            self.pdf_deal_client.pdf2file(
-                waiting_process_list,
-                output_path=ZIPS_DIR,
-                output_names=renamed_path_list,
-                output_format='md'
-            )
+        return self.convert_pdfs_to_zips([pdf_path], [name])[0]
+    
+    def convert_pdfs_to_zips(self, pdf_paths: List[Path], names: List[str]) -> List[Optional[Path]]:
+        """Convert several PDFs to ZIP format with a single pdfdeal call.
+        
+        PDFs whose ZIP already exists from an earlier conversion are not sent again.
+        
+        Args:
+            pdf_paths: Paths to PDF files
+            names: Names to use for the ZIP files, in the same order as pdf_paths
             
+        Returns:
+            Path to each converted ZIP file, or None where conversion failed, in input order
+        """
+        from utils import sanitize_filename
+        
+        # Prepare lists for pdfdeal in one pass, checking each ZIP on disk only once
+        zip_paths, waiting_process_list, renamed_path_list = [], [], []
+        for pdf_path, name in zip(pdf_paths, names):
+            zip_path = ZIPS_DIR / f"{sanitize_filename(name)}.zip"
+            zip_paths.append(zip_path)
+            if not _is_converted(zip_path):
+                waiting_process_list.append(pdf_path)
+                renamed_path_list.append(zip_path)
+        
+        if waiting_process_list:
+            try:
+                self.pdf_deal_client.pdf2file(
+                    waiting_process_list,
+                    output_path=ZIPS_DIR,
+                    output_names=renamed_path_list,
+                    output_format='md'
+                )
+            except Exception as e:
+                logger.error(f"Error converting {len(waiting_process_list)} PDFs to ZIP: {e}")
+        
+        results = []
+        for zip_path in zip_paths:
             if zip_path.exists():
-                logger.info(f"Converted PDF to ZIP: {zip_path}")
-                return zip_path
+                results.append(zip_path)
             else:
                 logger.error(f"ZIP file not created: {zip_path}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error converting PDF to ZIP for {pdf_path}: {e}")
-            return None
+                results.append(None)
+        
+        logger.info(f"Converted {sum(1 for zip_path in results if zip_path)} of {len(zip_paths)} PDFs to ZIP")
+        return results
     
     def extract_context(self, zip_path: Path) -> Optional[str]:
-        """Unzip ZIP file and read .md file content.
+        """Read .md file content directly from the ZIP file, without extracting it to disk.
         
         Args:
             zip_path: Path to ZIP file
@@ -125,94 +228,312 @@ class PDFProcessor:
             Content of the Markdown file as string or None if failed
         """
         try:
-            # Create extraction directory for this ZIP
-            extract_dir = EXTRACTED_DIR / zip_path.stem
-            extract_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Extract ZIP file
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
+                # Take the first .md entry (usually there's only one), stopping at the first match
+                md_file = next((name for name in zip_ref.namelist() if name.endswith('.md')), None)
+                
+                if md_file is None:
+                    logger.warning(f"No .md file found in ZIP: {zip_path}")
+                    return None
+                
+                # Decode in bounded chunks while decompressing, so the entry is never held
+                # in memory as one byte string next to its decoded text
+                with zip_ref.open(md_file) as raw:
+                    reader = io.TextIOWrapper(raw, encoding='utf-8')
+                    context = ''.join(iter(lambda: reader.read(_READ_CHUNK_SIZE), ''))
+            
+            logger.info(f"Extracted context from {zip_path}:{md_file} ({len(context)} characters)")
+            return context
             
-            # Find .md file in extracted contents
-            md_files = list(extract_dir.rglob('*.md'))
+        except Exception as e:
+            logger.error(f"Error extracting context from {zip_path}: {e}")
+            return None
+    
+    def _extract_and_upload_zip(self, record: EligibleRecord, zip_path: Path) -> Optional[Tuple[str, str]]:
+        """Extract context from a converted ZIP and upload the ZIP, without updating the record.
+        
+        Args:
+            record: Record the ZIP belongs to
+            zip_path: Path to the record's converted ZIP file
             
-            if not md_files:
-                logger.warning(f"No .md file found in ZIP: {zip_path}")
+        Returns:
+            Tuple of (file token of the uploaded ZIP, context) or None if failed
+        """
+        try:
+            context = self.extract_context(zip_path)
+            if not context:
+                logger.error(f"Failed to extract context for record {record.record_id}")
                 return None
             
-            # Read the first .md file found (usually there's only one)
-            md_file = md_files[0]
-            with open(md_file, 'r', encoding='utf-8') as f:
-                context = f.read()
+            from utils import sanitize_filename
             
-            logger.info(f"Extracted context from {md_file} ({len(context)} characters)")
-            return context
+            file_token = self.feishu_client.upload_zip(
+                zip_path,
+                file_name=f"{sanitize_filename(record.name)}.zip"
+            )
+            return file_token, context
             
         except Exception as e:
-            logger.error(f"Error extracting context from {zip_path}: {e}")
+            logger.error(f"Error uploading record {record.record_id}: {e}")
             return None
     
-    def process_record(self, record) -> bool:
-        """Complete workflow for single record: download → convert → extract → upload.
+    def _extract_and_upload(self, record: EligibleRecord, zip_path: Path) -> bool:
+        """Extract context from a converted ZIP and upload both to the record.
         
         Args:
-            record: Record object from FEISHU
+            record: Record to update
+            zip_path: Path to the record's converted ZIP file
             
         Returns:
             True if successful, False otherwise
         """
-        record_id = record.record_id
-        name = self.feishu_client.get_record_name(record)
+        uploaded = self._extract_and_upload_zip(record, zip_path)
+        if not uploaded:
+            return False
         
         try:
-            logger.info(f"Processing record {record_id} ({name})")
+            file_token, context = uploaded
+            self.feishu_client.update_record(record.record_id, file_token, context)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error updating record {record.record_id}: {e}")
+            return False
+    
+    def cleanup_record(self, record: EligibleRecord) -> None:
+        """Remove the downloaded PDF of a single record, logging instead of raising on failure.
+        
+        The converted ZIP is kept as a cache, so retrying the record skips Doc2X; it is
+        removed by cleanup_files once older than CACHE_TTL_SECONDS.
+        
+        Args:
+            record: Record whose PDF file should be removed
+        """
+        try:
+            pdf_path = PDFS_DIR / f"{_file_stem(record)}.pdf"
+            with _origin_lock(record):
+                if pdf_path.exists():
+                    pdf_path.unlink()
+        except Exception as e:
+            logger.warning(f"Failed to clean up files for record {record.record_id}: {e}")
+    
+    def _prepare_zip(self, record: EligibleRecord) -> Optional[Path]:
+        """Get the converted ZIP of a record's origin file, downloading and converting only on a cache miss.
+        
+        Records sharing an origin file are serialized on its lock, so when several of them
+        are processed at once only the first downloads and converts the file; the others
+        find its ZIP in the cache.
+        
+        Args:
+            record: Eligible record to get the ZIP for
+            
+        Returns:
+            Path to converted ZIP file or None if failed
+        """
+        with _origin_lock(record):
+            zip_path = _cached_zip(record)
+            if zip_path:
+                logger.info(f"Reusing converted ZIP for record {record.record_id}: {zip_path}")
+                return zip_path
             
-            # Step 1: Download PDF
             pdf_path = self.download_pdf(record)
             if not pdf_path:
-                logger.error(f"Failed to download PDF for record {record_id}")
-                return False
+                logger.error(f"Failed to download PDF for record {record.record_id}")
+                return None
             
-            # Step 2: Convert PDF to ZIP
-            zip_path = self.convert_pdf_to_zip(pdf_path, name)
+            zip_path = self.convert_pdf_to_zip(pdf_path, _file_stem(record))
             if not zip_path:
-                logger.error(f"Failed to convert PDF to ZIP for record {record_id}")
-                # Cleanup PDF
-                if pdf_path.exists():
-                    pdf_path.unlink()
-                return False
+                logger.error(f"Failed to convert PDF to ZIP for record {record.record_id}")
+            return zip_path
+    
+    def process_record(self, record: EligibleRecord) -> bool:
+        """Complete workflow for single record: download → convert → extract → upload.
+        
+        Args:
+            record: Eligible record to process
             
-            # Step 3: Extract context from ZIP
-            context = self.extract_context(zip_path)
-            if not context:
-                logger.error(f"Failed to extract context for record {record_id}")
-                # Cleanup files
-                if pdf_path.exists():
-                    pdf_path.unlink()
-                if zip_path.exists():
-                    zip_path.unlink()
-                return False
+        Returns:
+            True if successful, False otherwise
+        """
+        record_id = record.record_id
+        name = record.name
+        
+        try:
+            logger.info(f"Processing record {record_id} ({name})")
             
-            # Step 4: Upload ZIP and context to FEISHU
-            self.feishu_client.upload_zip_and_context(
-                record_id=record_id,
-                zip_path=zip_path,
-                context=context
-            )
+            # Step 1 & 2: Download PDF and convert it to ZIP, unless its ZIP is cached
+            zip_path = self._prepare_zip(record)
+            if not zip_path:
+                self.cleanup_record(record)
+                return False
             
-            # Step 5: Cleanup temporary files
-            if pdf_path.exists():
-                pdf_path.unlink()
+            # Step 3 & 4: Extract context from ZIP and upload both to FEISHU
+            success = self._extract_and_upload(record, zip_path)
             
-            # Cleanup extracted directory
-            extract_dir = EXTRACTED_DIR / zip_path.stem
-            if extract_dir.exists():
-                shutil.rmtree(extract_dir)
+            # Step 5: Cleanup PDF, the ZIP stays cached until it expires so a retry skips the conversion
+            self.cleanup_record(record)
+            if not success:
+                return False
             
             logger.info(f"Successfully processed record {record_id}")
             return True
             
         except Exception as e:
             logger.error(f"Error processing record {record_id}: {e}")
+            self.cleanup_record(record)
             return False
-
+    
+    def process_records(self, records: List[EligibleRecord], max_downloads: int = MAX_WORKERS,
+                        convert_batch_size: int = CONVERT_BATCH_SIZE) -> Dict[str, bool]:
+        """Process several records as a pipeline: download → convert → extract and upload → update.
+        
+        Downloads and uploads run on the processor's shared executor. Downloaded PDFs are
+        converted in batches of convert_batch_size with a single pdfdeal call per batch as
+        soon as the batch is full, so later records keep downloading and earlier ones keep
+        uploading while a batch is being converted. Only max_downloads downloads are queued
+        at a time, so uploads do not wait behind every download of the run. Records sharing
+        the same origin file are downloaded and converted once, and the result is uploaded
+        to each of them. Origin files with a cached ZIP from an earlier run go straight to
+        the upload. Each origin file's lock is held from its download until its conversion;
+        files locked by a concurrent run are left for last and then reuse that run's ZIP.
+        Finished uploads are collected while downloads and conversions are still running,
+        and written to the table with a batch update request whenever BATCH_UPDATE_SIZE of
+        them are ready, instead of one request per record. Each record's PDF is removed as
+        soon as its upload is finished or has failed.
+        
+        Args:
+            records: Eligible records to process
+            max_downloads: Number of downloads queued or running at the same time
+            convert_batch_size: Number of PDFs sent to pdfdeal in one call
+            
+        Returns:
+            Mapping of record ID to whether its processing succeeded
+        """
+        results = {record.record_id: False for record in records}
+        
+        # Group records by origin file, only the first record of each group is downloaded
+        duplicates: Dict[str, List[EligibleRecord]] = {}
+        for record in records:
+            duplicates.setdefault(record.origin_token or record.record_id, []).append(record)
+        groups = {group[0].record_id: group for group in duplicates.values()}
+        
+        upload_futures = {}
+        
+        def extract_and_upload(record: EligibleRecord, zip_path: Path) -> Optional[Tuple[str, str]]:
+            try:
+                return self._extract_and_upload_zip(record, zip_path)
+            finally:
+                self.cleanup_record(record)
+        
+        def submit_uploads(record: EligibleRecord, zip_path: Path) -> None:
+            for member in groups[record.record_id]:
+                upload_futures[self.executor.submit(extract_and_upload, member, zip_path)] = member
+        
+        def convert_batch(batch: List[Tuple[EligibleRecord, Path]]) -> None:
+            zip_paths = self.convert_pdfs_to_zips(
+                [pdf_path for _, pdf_path in batch],
+                [_file_stem(record) for record, _ in batch]
+            )
+            for (record, _), zip_path in zip(batch, zip_paths):
+                held.pop(record.record_id).release()
+                if zip_path:
+                    submit_uploads(record, zip_path)
+                else:
+                    logger.error(f"Failed to convert PDF to ZIP for record {record.record_id}")
+                    self.cleanup_record(record)
+        
+        updates = []
+        
+        def write_back(chunk: List[Tuple[str, str, str]]) -> None:
+            for record_id in self.feishu_client.batch_update_records(chunk):
+                results[record_id] = True
+                logger.info(f"Successfully processed record {record_id}")
+        
+        def collect_uploads(finished) -> None:
+            # Drop finished uploads as they are collected, and write back every full batch
+            # right away instead of holding all contexts until the end of the run
+            for future in finished:
+                member = upload_futures.pop(future)
+                uploaded = future.result()
+                if uploaded:
+                    file_token, context = uploaded
+                    updates.append((member.record_id, file_token, context))
+            while len(updates) >= BATCH_UPDATE_SIZE:
+                write_back(updates[:BATCH_UPDATE_SIZE])
+                del updates[:BATCH_UPDATE_SIZE]
+        
+        pending = iter(group[0] for group in groups.values())
+        download_futures = {}
+        held: Dict[str, threading.Lock] = {}
+        deferred = []
+        
+        def start_downloads() -> None:
+            for record in pending:
+                # Never wait for a lock while holding others, a concurrent batch could hold them
+                lock = _origin_lock(record)
+                if not lock.acquire(blocking=False):
+                    deferred.append(record)
+                    continue
+                
+                # Origin files converted in an earlier run skip the download and conversion
+                zip_path = _cached_zip(record)
+                if zip_path:
+                    lock.release()
+                    submit_uploads(record, zip_path)
+                    continue
+                
+                held[record.record_id] = lock
+                download_futures[self.executor.submit(self.download_pdf, record)] = record
+                if len(download_futures) >= max_downloads:
+                    return
+        
+        # Stage 1 → 2 → 3 → 4: convert downloaded PDFs in batches while the rest keep
+        # downloading, and write back uploads as they finish
+        try:
+            batch = []
+            while True:
+                start_downloads()
+                if not download_futures:
+                    break
+                
+                done, _ = wait([*download_futures, *upload_futures], return_when=FIRST_COMPLETED)
+                collect_uploads([future for future in done if future in upload_futures])
+                
+                for future in done:
+                    if future not in download_futures:
+                        continue
+                    record = download_futures.pop(future)
+                    pdf_path = future.result()
+                    if not pdf_path:
+                        logger.error(f"Failed to download PDF for record {record.record_id}")
+                        held.pop(record.record_id).release()
+                        self.cleanup_record(record)
+                        continue
+                    
+                    batch.append((record, pdf_path))
+                    if len(batch) >= convert_batch_size:
+                        convert_batch(batch)
+                        batch = []
+            
+            if batch:
+                convert_batch(batch)
+        finally:
+            # Do not leave origin files locked for other runs if the batch failed midway
+            for lock in held.values():
+                lock.release()
+        
+        # Origin files a concurrent run was working on: wait for it, then reuse its ZIP
+        for record in deferred:
+            zip_path = self._prepare_zip(record)
+            if zip_path:
+                submit_uploads(record, zip_path)
+            else:
+                self.cleanup_record(record)
+            collect_uploads([future for future in upload_futures if future.done()])
+        
+        # Drain the remaining uploads and write back the last partial batch
+        collect_uploads(as_completed(list(upload_futures)))
+        if updates:
+            write_back(updates)
+        
+        return results
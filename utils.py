@@ -1,9 +1,13 @@
 """Utility functions for file management and logging."""
 import logging
 import shutil
+import time
 from pathlib import Path
 from typing import Optional
-from config import LOG_DIR, LOG_FILE, PDFS_DIR, ZIPS_DIR, EXTRACTED_DIR
+from config import LOG_DIR, LOG_FILE, PDFS_DIR, ZIPS_DIR, EXTRACTED_DIR, CACHE_TTL_SECONDS
+
+# Characters not allowed in filenames, each mapped to an underscore
+_SANITIZE_TABLE = str.maketrans({char: '_' for char in '<>:"/\\|?*'})
 
 
 def setup_logging(log_level: int = logging.INFO) -> None:
@@ -12,7 +16,7 @@ def setup_logging(log_level: int = logging.INFO) -> None:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
     
     # Configure logging format
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    log_format = '%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s'
     date_format = '%Y-%m-%d %H:%M:%S'
     
     # Configure root logger
@@ -34,29 +38,33 @@ def ensure_directories() -> None:
     EXTRACTED_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def cleanup_files(folder: Optional[Path] = None) -> None:
+def cleanup_files(folder: Optional[Path] = None, max_age: int = CACHE_TTL_SECONDS) -> None:
     """Remove temporary files after processing.
     
+    Files modified within the last max_age seconds are kept, so converted ZIPs survive
+    between runs and are reused instead of converting again.
+    
     Args:
         folder: Specific folder to clean. If None, cleans all subdirectories in files/.
+        max_age: Age in seconds below which files are kept. 0 removes everything.
     """
-    if folder is None:
-        # Clean all subdirectories
-        for subdir in [PDFS_DIR, ZIPS_DIR, EXTRACTED_DIR]:
-            if subdir.exists():
-                for item in subdir.iterdir():
-                    if item.is_file():
-                        item.unlink()
-                    elif item.is_dir():
-                        shutil.rmtree(item)
-    else:
-        # Clean specific folder
-        if folder.exists():
-            for item in folder.iterdir():
-                if item.is_file():
-                    item.unlink()
-                elif item.is_dir():
+    cutoff = time.time() - max_age
+    folders = [PDFS_DIR, ZIPS_DIR, EXTRACTED_DIR] if folder is None else [folder]
+    
+    for subdir in folders:
+        if not subdir.exists():
+            continue
+        for item in subdir.iterdir():
+            # A concurrent run may remove its own files while this one is sweeping
+            try:
+                if max_age > 0 and item.stat().st_mtime > cutoff:
+                    continue
+                if item.is_dir():
                     shutil.rmtree(item)
+                else:
+                    item.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
 
 
 def sanitize_filename(filename: str) -> str:
@@ -68,9 +76,6 @@ def sanitize_filename(filename: str) -> str:
     Returns:
         Sanitized filename safe for filesystem
     """
-    # Replace invalid characters with underscore
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    return filename.strip()
+    # Replace invalid characters with underscore in a single pass
+    return filename.translate(_SANITIZE_TABLE).strip()
 